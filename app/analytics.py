@@ -1,9 +1,18 @@
 from __future__ import annotations
 
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
 from dataclasses import dataclass
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
+if int(pd.__version__.split(".")[0]) < 3:
+    # pandas >= 3 always copies on write; earlier releases need the opt-in.
+    pd.set_option("mode.copy_on_write", True)
+
 
 @dataclass
 class GlucoseSummary:
@@ -17,12 +26,6 @@ class GlucoseSummary:
     hyper_count: int
 
 
-def _mean_or_none(series: pd.Series) -> float | None:
-    if series.empty:
-        return None
-    return float(series.mean())
-
-
 def summarize_glucose(
     glucose_df: pd.DataFrame,
     target_low: int,
@@ -33,27 +36,143 @@ def summarize_glucose(
     if glucose_df.empty:
         return GlucoseSummary(None, None, None, None, None, 0.0, 0, 0)
 
-    df = glucose_df.copy()
-    df["recorded_at"] = pd.to_datetime(df["recorded_at"])
-    df = df.sort_values("recorded_at")
-    now = pd.Timestamp.now()
+    recorded_at = pd.to_datetime(glucose_df["recorded_at"], format="ISO8601", cache=True)
+    timestamps = recorded_at.to_numpy(dtype="datetime64[ns]").view("i8")
+    values = glucose_df["value_mg_dl"].to_numpy(dtype="float64")
+    age = pd.Timestamp.now().value - timestamps
 
-    def within_days(days: int) -> pd.Series:
-        start = now - pd.Timedelta(days=days)
-        return df.loc[df["recorded_at"] >= start, "value_mg_dl"]
+    def window_mean(days: int) -> float | None:
+        in_window = age <= pd.Timedelta(days=days).value
+        count = np.count_nonzero(in_window)
+        if count == 0:
+            return None
+        return float(np.dot(values, in_window) / count)
 
-    values = df["value_mg_dl"]
-    in_range = values.between(target_low, target_high, inclusive="both")
+    in_range = np.count_nonzero((values >= target_low) & (values <= target_high))
 
     return GlucoseSummary(
-        avg_7d=_mean_or_none(within_days(7)),
-        avg_14d=_mean_or_none(within_days(14)),
-        avg_30d=_mean_or_none(within_days(30)),
+        avg_7d=window_mean(7),
+        avg_14d=window_mean(14),
+        avg_30d=window_mean(30),
         minimum=float(values.min()),
         maximum=float(values.max()),
-        in_range_pct=float(in_range.mean() * 100.0),
-        hypo_count=int((values < hypo_threshold).sum()),
-        hyper_count=int((values > hyper_threshold).sum()),
+        in_range_pct=float(in_range / values.size * 100.0),
+        hypo_count=int(np.count_nonzero(values < hypo_threshold)),
+        hyper_count=int(np.count_nonzero(values > hyper_threshold)),
+    )
+
+
+_SUMMARY_CACHE_SIZE = 64
+_summary_cache: OrderedDict[tuple, GlucoseSummary] = OrderedDict()
+_summary_cache_lock = threading.Lock()
+
+
+def summarize_glucose_cached(
+    cache_key: Hashable,
+    glucose_df: pd.DataFrame,
+    target_low: int,
+    target_high: int,
+    hypo_threshold: int,
+    hyper_threshold: int,
+) -> GlucoseSummary:
+    # The hour keeps the 7/14/30 day windows from going stale while the data is unchanged.
+    key = (cache_key, target_low, target_high, hypo_threshold, hyper_threshold, datetime.now().strftime("%Y%m%d%H"))
+    with _summary_cache_lock:
+        if key in _summary_cache:
+            _summary_cache.move_to_end(key)
+            return _summary_cache[key]
+
+    summary = summarize_glucose(glucose_df, target_low, target_high, hypo_threshold, hyper_threshold)
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        if len(_summary_cache) > _SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summary
+
+
+def downsample_minmax(df: pd.DataFrame, value_column: str, max_points: int = 2000) -> pd.DataFrame:
+    if len(df) <= max_points:
+        return df
+
+    values = df[value_column].to_numpy(dtype="float64")
+    missing = np.isnan(values)
+    buckets = max(1, (max_points - 2) // 2)
+    size = -(-len(values) // buckets)
+    rows = -(-len(values) // size)
+    padding = rows * size - len(values)
+
+    # Keep the lowest and highest reading of each contiguous bucket so hypo/hyper spikes survive.
+    low = np.pad(np.where(missing, np.inf, values), (0, padding), constant_values=np.inf).reshape(rows, size)
+    high = np.pad(np.where(missing, -np.inf, values), (0, padding), constant_values=-np.inf).reshape(rows, size)
+    offsets = np.arange(rows) * size
+    positions = np.unique(
+        np.concatenate([[0, len(values) - 1], offsets + low.argmin(axis=1), offsets + high.argmax(axis=1)])
+    )
+    return df.iloc[positions[positions < len(values)]]
+
+
+_GLUCOSE_RECOMMENDATIONS: tuple[tuple[str, str], ...] = (
+    (
+        "error",
+        "Glucosa muy baja. Toma carbohidrato de acción rápida y busca atención médica si no mejora pronto.",
+    ),
+    (
+        "warning",
+        "Glucosa baja. Toma carbohidrato de acción rápida, vuelve a medir en 15 minutos y contacta a tu médico si persiste.",
+    ),
+    ("success", "Valor en rango objetivo. Continúa con tu plan indicado por tu médico."),
+    (
+        "info",
+        "Valor elevado. Hidrátate, revisa tus indicaciones de tratamiento y vuelve a medir según recomendación médica.",
+    ),
+    (
+        "error",
+        "Glucosa muy elevada. Contacta a tu médico para orientación y considera atención urgente si tienes síntomas.",
+    ),
+)
+
+
+def glucose_recommendation_levels(
+    values,
+    target_low: int,
+    target_high: int,
+    hypo_threshold: int,
+    hyper_threshold: int,
+) -> np.ndarray:
+    values = np.asarray(values, dtype="float64")
+    # First matching rule wins; the thresholds are user settings and need not be ordered.
+    return np.select(
+        [
+            values < 54,
+            values < hypo_threshold,
+            (values >= target_low) & (values <= target_high),
+            values <= hyper_threshold,
+        ],
+        [0, 1, 2, 3],
+        default=4,
+    )
+
+
+def glucose_recommendation(
+    value_mg_dl: float,
+    target_low: int,
+    target_high: int,
+    hypo_threshold: int,
+    hyper_threshold: int,
+) -> tuple[str, str]:
+    level = glucose_recommendation_levels([value_mg_dl], target_low, target_high, hypo_threshold, hyper_threshold)
+    return _GLUCOSE_RECOMMENDATIONS[int(level[0])]
+
+
+def _timeline_frame(
+    source: pd.DataFrame,
+    evento: pd.Series | str,
+    detalle: pd.Series | str,
+    notes: pd.Series | str,
+) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"recorded_at": source["recorded_at"], "evento": evento, "detalle": detalle, "notes": notes},
+        index=source.index,
     )
 
 
@@ -61,27 +180,21 @@ def build_timeline(glucose_df: pd.DataFrame, hba1c_df: pd.DataFrame, events_df:
     frames: list[pd.DataFrame] = []
 
     if not glucose_df.empty:
-        g = glucose_df.copy()
-        g["evento"] = "Glucosa"
-        g["detalle"] = g["value_mg_dl"].astype(str) + " mg/dL" + " | " + g.get("context", "")
-        frames.append(g[["recorded_at", "evento", "detalle", "notes"]])
+        detalle = glucose_df["value_mg_dl"].astype(str) + " mg/dL" + " | " + glucose_df.get("context", "")
+        frames.append(_timeline_frame(glucose_df, "Glucosa", detalle, glucose_df["notes"]))
 
     if not hba1c_df.empty:
-        h = hba1c_df.copy()
-        h["evento"] = "HbA1c"
-        h["detalle"] = h["value_pct"].astype(str) + " %"
-        frames.append(h[["recorded_at", "evento", "detalle", "notes"]])
+        frames.append(_timeline_frame(hba1c_df, "HbA1c", hba1c_df["value_pct"].astype(str) + " %", hba1c_df["notes"]))
 
     if not events_df.empty:
-        e = events_df.copy()
-        e["evento"] = e.get("title", "Evento")
-        e["detalle"] = e.get("notes", "")
-        e["notes"] = e.get("notes", "")
-        frames.append(e[["recorded_at", "evento", "detalle", "notes"]])
+        notes = events_df.get("notes", "")
+        frames.append(_timeline_frame(events_df, events_df.get("title", "Evento"), notes, notes))
 
     if not frames:
         return pd.DataFrame(columns=["recorded_at", "evento", "detalle", "notes"])
 
     timeline = pd.concat(frames, ignore_index=True)
-    timeline["recorded_at"] = pd.to_datetime(timeline["recorded_at"])
-    return timeline.sort_values("recorded_at", ascending=False)
+    if not pd.api.types.is_datetime64_any_dtype(timeline["recorded_at"]):
+        timeline["recorded_at"] = pd.to_datetime(timeline["recorded_at"], format="ISO8601", cache=True)
+    # Each source arrives already ordered by recorded_at; a stable sort merges the runs cheaply.
+    return timeline.sort_values("recorded_at", ascending=False, kind="mergesort")
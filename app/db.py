@@ -1,23 +1,81 @@
+import atexit
 import json
 import sqlite3
+import threading
+import weakref
+from collections.abc import Iterator
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Any
 
+import orjson
 from cryptography.fernet import Fernet
 
 DB_PATH = Path("data/app.db")
 
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+)
 
-def get_connection(db_path: Path = DB_PATH) -> sqlite3.Connection:
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+_conn_cache = threading.local()
+_open_connections: "weakref.WeakSet[_CachedConnection]" = weakref.WeakSet()
+
+
+class _CachedConnection(sqlite3.Connection):
+    """Plain subclass so open connections can be tracked weakly and closed at exit."""
+
+
+@atexit.register
+def _close_connections() -> None:
+    for conn in list(_open_connections):
+        conn.close()
+
+
+def get_connection(db_path: Path | None = None) -> sqlite3.Connection:
+    db_path = db_path or DB_PATH
+    connections = getattr(_conn_cache, "connections", None)
+    if connections is None:
+        connections = _conn_cache.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            factory=_CachedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        connections[db_path] = conn
+        _open_connections.add(conn)
     return conn
 
 
-def init_db(db_path: Path = DB_PATH) -> None:
-    with get_connection(db_path) as conn:
+@contextmanager
+def transaction(db_path: Path | None = None) -> Iterator[sqlite3.Connection]:
+    conn = get_connection(db_path)
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        # Also covers a failed COMMIT (e.g. SQLITE_BUSY) so the cached connection never stays mid-transaction.
+        conn.rollback()
+        raise
+
+
+def init_db(db_path: Path | None = None) -> None:
+    with transaction(db_path) as conn:
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -45,7 +103,7 @@ def init_db(db_path: Path = DB_PATH) -> None:
                 owner TEXT NOT NULL,
                 record_type TEXT NOT NULL,
                 recorded_at TEXT NOT NULL,
-                payload_encrypted TEXT NOT NULL,
+                payload_encrypted BLOB NOT NULL,
                 created_at TEXT NOT NULL,
                 updated_at TEXT NOT NULL,
                 UNIQUE(owner, record_type, recorded_at)
@@ -62,7 +120,7 @@ def init_db(db_path: Path = DB_PATH) -> None:
                     owner TEXT NOT NULL,
                     record_type TEXT NOT NULL,
                     recorded_at TEXT NOT NULL,
-                    payload_encrypted TEXT NOT NULL,
+                    payload_encrypted BLOB NOT NULL,
                     created_at TEXT NOT NULL,
                     updated_at TEXT NOT NULL,
                     UNIQUE(owner, record_type, recorded_at)
@@ -79,6 +137,8 @@ def init_db(db_path: Path = DB_PATH) -> None:
             conn.execute("DROP TABLE records")
             conn.execute("ALTER TABLE records_new RENAME TO records")
 
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_records_owner_recorded_at ON records(owner, recorded_at)")
+
 
 def _scoped_key(key: str, owner: str | None) -> str:
     if owner:
@@ -88,8 +148,7 @@ def _scoped_key(key: str, owner: str | None) -> str:
 
 def get_setting(key: str, default: str | None = None, owner: str | None = None) -> str | None:
     scoped = _scoped_key(key, owner)
-    with get_connection() as conn:
-        row = conn.execute("SELECT value FROM settings WHERE key = ?", (scoped,)).fetchone()
+    row = get_connection().execute("SELECT value FROM settings WHERE key = ?", (scoped,)).fetchone()
     if row is None:
         return default
     return row["value"]
@@ -97,7 +156,7 @@ def get_setting(key: str, default: str | None = None, owner: str | None = None)
 
 def set_setting(key: str, value: str, owner: str | None = None) -> None:
     scoped = _scoped_key(key, owner)
-    with get_connection() as conn:
+    with transaction() as conn:
         conn.execute(
             """
             INSERT INTO settings(key, value) VALUES(?, ?)
@@ -107,15 +166,26 @@ def set_setting(key: str, value: str, owner: str | None = None) -> None:
         )
 
 
-def get_user(patient_code: str) -> dict | None:
-    with get_connection() as conn:
-        row = conn.execute(
+def set_settings_bulk(pairs: list[tuple[str, str]], owner: str | None = None) -> None:
+    scoped = [(_scoped_key(key, owner), value) for key, value in pairs]
+    with transaction() as conn:
+        conn.executemany(
             """
-            SELECT patient_code, patient_name, pin_salt, pin_hash, consent, created_at
-            FROM users WHERE patient_code = ?
+            INSERT INTO settings(key, value) VALUES(?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
             """,
-            (patient_code,),
-        ).fetchone()
+            scoped,
+        )
+
+
+def get_user(patient_code: str) -> dict | None:
+    row = get_connection().execute(
+        """
+        SELECT patient_code, patient_name, pin_salt, pin_hash, consent, created_at
+        FROM users WHERE patient_code = ?
+        """,
+        (patient_code,),
+    ).fetchone()
     return dict(row) if row else None
 
 
@@ -127,7 +197,7 @@ def create_user(
     consent: str = "true",
 ) -> None:
     now = datetime.utcnow().isoformat()
-    with get_connection() as conn:
+    with transaction() as conn:
         conn.execute(
             """
             INSERT INTO users(patient_code, patient_name, pin_salt, pin_hash, consent, created_at)
@@ -137,16 +207,31 @@ def create_user(
         )
 
 
+_DUP_SQL = "SELECT 1 FROM records WHERE owner = ? AND record_type = ? AND recorded_at = ? LIMIT 1"
+_DUP_SQL_EXCL = "SELECT 1 FROM records WHERE owner = ? AND record_type = ? AND recorded_at = ? AND id != ? LIMIT 1"
+
+
 def has_duplicate(owner: str, record_type: str, recorded_at: str, exclude_id: int | None = None) -> bool:
-    query = "SELECT id FROM records WHERE owner = ? AND record_type = ? AND recorded_at = ?"
-    params: list[Any] = [owner, record_type, recorded_at]
-    if exclude_id is not None:
-        query += " AND id != ?"
-        params.append(exclude_id)
+    if exclude_id is None:
+        cursor = get_connection().execute(_DUP_SQL, (owner, record_type, recorded_at))
+    else:
+        cursor = get_connection().execute(_DUP_SQL_EXCL, (owner, record_type, recorded_at, exclude_id))
+    return cursor.fetchone() is not None
 
-    with get_connection() as conn:
-        row = conn.execute(query, tuple(params)).fetchone()
-    return row is not None
+
+def _encrypt_payload(payload: dict, fernet: Fernet) -> bytes:
+    return fernet.encrypt(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY))
+
+
+def records_fingerprint(owner: str, record_type: str | None = None) -> tuple[Any, ...]:
+    query = "SELECT MAX(updated_at), COUNT(*) FROM records WHERE owner = ?"
+    params: tuple[Any, ...] = (owner,)
+    if record_type:
+        query += " AND record_type = ?"
+        params = (owner, record_type)
+
+    last_updated, count = get_connection().execute(query, params).fetchone()
+    return (owner, record_type, last_updated, count)
 
 
 def save_record(
@@ -158,9 +243,9 @@ def save_record(
     record_id: int | None = None,
 ) -> int:
     now = datetime.utcnow().isoformat()
-    encrypted = fernet.encrypt(json.dumps(payload, ensure_ascii=False).encode("utf-8")).decode("utf-8")
+    encrypted = _encrypt_payload(payload, fernet)
 
-    with get_connection() as conn:
+    with transaction() as conn:
         if record_id is None:
             cursor = conn.execute(
                 """
@@ -182,6 +267,38 @@ def save_record(
         return record_id
 
 
+def save_records_bulk(
+    owner: str,
+    record_type: str,
+    rows: list[tuple[str, dict]],
+    fernet: Fernet,
+) -> int:
+    now = datetime.utcnow().isoformat()
+    encrypted = [
+        (
+            owner,
+            record_type,
+            recorded_at,
+            _encrypt_payload(payload, fernet),
+            now,
+            now,
+        )
+        for recorded_at, payload in rows
+    ]
+    if not encrypted:
+        return 0
+
+    with transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO records(owner, record_type, recorded_at, payload_encrypted, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            encrypted,
+        )
+    return len(encrypted)
+
+
 def delete_record(record_id: int, owner: str | None = None) -> None:
     query = "DELETE FROM records WHERE id = ?"
     params: list[Any] = [record_id]
@@ -189,37 +306,87 @@ def delete_record(record_id: int, owner: str | None = None) -> None:
         query += " AND owner = ?"
         params.append(owner)
 
-    with get_connection() as conn:
+    with transaction() as conn:
         conn.execute(query, tuple(params))
 
 
-def load_records(owner: str, fernet: Fernet, record_type: str | None = None) -> list[dict]:
+def load_records_ciphertexts(
+    owner: str,
+    record_type: str | None = None,
+    since: str | None = None,
+) -> list[sqlite3.Row]:
     query = "SELECT id, owner, record_type, recorded_at, payload_encrypted FROM records WHERE owner = ?"
-    params: tuple[Any, ...] = (owner,)
+    params: list[Any] = [owner]
     if record_type:
         query += " AND record_type = ?"
-        params = (owner, record_type)
+        params.append(record_type)
+    if since:
+        query += " AND recorded_at >= ?"
+        params.append(since)
     query += " ORDER BY recorded_at DESC"
+    return get_connection().execute(query, tuple(params)).fetchall()
 
-    rows: list[dict] = []
-    with get_connection() as conn:
-        for row in conn.execute(query, params).fetchall():
-            decrypted = fernet.decrypt(row["payload_encrypted"].encode("utf-8"))
-            payload = json.loads(decrypted.decode("utf-8"))
-            rows.append(
-                {
-                    "id": row["id"],
-                    "owner": row["owner"],
-                    "record_type": row["record_type"],
-                    "recorded_at": row["recorded_at"],
-                    **payload,
-                }
-            )
-    return rows
+
+def loads_json_bytes(raw: bytes) -> dict:
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        # JSON written by the stdlib encoder (older records and share packages) may contain NaN, which orjson rejects.
+        return json.loads(raw)
+
+
+def _decrypt_payloads(rows: list[sqlite3.Row], fernet: Fernet) -> list[dict]:
+    return [loads_json_bytes(fernet.decrypt(row["payload_encrypted"])) for row in rows]
+
+
+def load_records(
+    owner: str,
+    fernet: Fernet,
+    record_type: str | None = None,
+    since: str | None = None,
+) -> list[dict]:
+    rows = load_records_ciphertexts(owner, record_type, since)
+    return [
+        {
+            "id": row["id"],
+            "owner": row["owner"],
+            "record_type": row["record_type"],
+            "recorded_at": row["recorded_at"],
+            **payload,
+        }
+        for row, payload in zip(rows, _decrypt_payloads(rows, fernet))
+    ]
+
+
+def decrypt_record_columns(rows: list[sqlite3.Row], fernet: Fernet) -> dict[str, list]:
+    columns: dict[str, list] = {"id": [], "owner": [], "record_type": [], "recorded_at": []}
+    for index, (row, payload) in enumerate(zip(rows, _decrypt_payloads(rows, fernet))):
+        columns["id"].append(row["id"])
+        columns["owner"].append(row["owner"])
+        columns["record_type"].append(row["record_type"])
+        columns["recorded_at"].append(row["recorded_at"])
+        for key, value in payload.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * index
+            column.append(value)
+        for column in columns.values():
+            if len(column) == index:
+                column.append(None)
+    return columns
+
+
+def load_record_columns(
+    owner: str,
+    fernet: Fernet,
+    record_type: str | None = None,
+    since: str | None = None,
+) -> dict[str, list]:
+    return decrypt_record_columns(load_records_ciphertexts(owner, record_type, since), fernet)
 
 
 def reset_local_data() -> None:
-    with get_connection() as conn:
+    with transaction() as conn:
         conn.execute("DELETE FROM records")
         conn.execute("DELETE FROM settings")
         conn.execute("DELETE FROM users")
@@ -1,27 +1,76 @@
 from __future__ import annotations
 
 import io
-import json
 from datetime import datetime, timedelta
 
+import orjson
 import pandas as pd
+import xlsxwriter
 from cryptography.fernet import Fernet
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 
+from app.db import loads_json_bytes
+
 
 def dataframe_to_csv_bytes(df: pd.DataFrame) -> bytes:
-    return df.to_csv(index=False).encode("utf-8")
+    output = io.BytesIO()
+    df.to_csv(output, index=False, encoding="utf-8")
+    return output.getvalue()
+
+
+def _excel_columns(df: pd.DataFrame) -> list[list]:
+    columns = []
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        values = series.astype(object).where(series.notna(), None).tolist()
+        if series.dtype == object:
+            values = [str(value) if isinstance(value, (list, tuple, dict, set)) else value for value in values]
+        columns.append(values)
+    return columns
 
 
 def dataframe_to_excel_bytes(df_map: dict[str, pd.DataFrame]) -> bytes:
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        for sheet_name, df in df_map.items():
-            safe_sheet = sheet_name[:31] if sheet_name else "Sheet1"
-            df.to_excel(writer, sheet_name=safe_sheet, index=False)
-    output.seek(0)
-    return output.read()
+    workbook = xlsxwriter.Workbook(
+        output,
+        {
+            "constant_memory": True,
+            "strings_to_numbers": False,
+            "strings_to_formulas": False,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+            "remove_timezone": True,
+        },
+    )
+    for sheet_name, df in df_map.items():
+        worksheet = workbook.add_worksheet(sheet_name[:31] if sheet_name else "Sheet1")
+        worksheet.write_row(0, 0, df.columns.tolist())
+        # constant_memory flushes each row once a later one is started, so rows must be written in order.
+        for row_index, row in enumerate(zip(*_excel_columns(df)), 1):
+            worksheet.write_row(row_index, 0, row)
+    workbook.close()
+    return output.getvalue()
+
+
+def _draw_lines(
+    c: canvas.Canvas,
+    lines: list[str],
+    y: float,
+    font_size: int,
+    leading: int,
+    page_top: float,
+) -> float:
+    text = c.beginText(60, y)
+    text.setFont("Helvetica", font_size, leading)
+    for line in lines:
+        text.textLine(line)
+        if text.getY() < 80:
+            c.drawText(text)
+            c.showPage()
+            text = c.beginText(60, page_top)
+            text.setFont("Helvetica", font_size, leading)
+    c.drawText(text)
+    return text.getY()
 
 
 def build_pdf_report(
@@ -30,11 +79,26 @@ def build_pdf_report(
     glucose_df: pd.DataFrame,
     hba1c_df: pd.DataFrame,
 ) -> bytes:
+    glucose_lines: list[str] = []
+    if not glucose_df.empty:
+        recent = glucose_df.head(15)
+        contexts = recent["context"] if "context" in recent else [""] * len(recent)
+        glucose_lines = [
+            f"{recorded_at} | {value} mg/dL | {context}"
+            for recorded_at, value, context in zip(recent["recorded_at"], recent["value_mg_dl"], contexts)
+        ]
+
+    hba1c_lines: list[str] = []
+    if not hba1c_df.empty:
+        recent = hba1c_df.head(10)
+        hba1c_lines = [f"{recorded_at} | {value}%" for recorded_at, value in zip(recent["recorded_at"], recent["value_pct"])]
+
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
+    page_top = height - 50
 
-    y = height - 50
+    y = page_top
     c.setFont("Helvetica-Bold", 14)
     c.drawString(50, y, "Reporte clínico de glucosa")
     y -= 20
@@ -47,41 +111,36 @@ def build_pdf_report(
     c.setFont("Helvetica-Bold", 11)
     c.drawString(50, y, "Resumen")
     y -= 16
-    c.setFont("Helvetica", 10)
-    for line in summary_lines:
-        c.drawString(60, y, f"- {line}")
-        y -= 14
-        if y < 80:
-            c.showPage()
-            y = height - 50
+    y = _draw_lines(c, [f"- {line}" for line in summary_lines], y, 10, 14, page_top)
 
     c.setFont("Helvetica-Bold", 11)
     c.drawString(50, y, "Últimos registros de glucosa")
     y -= 16
-    c.setFont("Helvetica", 9)
-    for _, row in glucose_df.head(15).iterrows():
-        c.drawString(60, y, f"{row['recorded_at']} | {row['value_mg_dl']} mg/dL | {row.get('context', '')}")
-        y -= 12
-        if y < 80:
-            c.showPage()
-            y = height - 50
+    y = _draw_lines(c, glucose_lines, y, 9, 12, page_top)
 
     c.setFont("Helvetica-Bold", 11)
     c.drawString(50, y, "Registros HbA1c")
     y -= 16
-    c.setFont("Helvetica", 9)
-    for _, row in hba1c_df.head(10).iterrows():
-        c.drawString(60, y, f"{row['recorded_at']} | {row['value_pct']}%")
-        y -= 12
-        if y < 80:
-            c.showPage()
-            y = height - 50
+    _draw_lines(c, hba1c_lines, y, 9, 12, page_top)
 
     c.save()
     buffer.seek(0)
     return buffer.read()
 
 
+_SHARE_DROPPED_COLUMNS = ["owner", "record_type"]
+
+
+def dataframe_to_share_records(df: pd.DataFrame) -> list[dict]:
+    if df.empty:
+        return []
+    # owner and record_type are implied by the package itself; with copy-on-write neither step copies the frame.
+    shared = df.drop(columns=_SHARE_DROPPED_COLUMNS, errors="ignore")
+    if pd.api.types.is_datetime64_any_dtype(shared["recorded_at"]):
+        shared = shared.assign(recorded_at=shared["recorded_at"].dt.strftime("%Y-%m-%dT%H:%M:%S"))
+    return shared.to_dict(orient="records")
+
+
 def build_encrypted_share_payload(data: dict, valid_hours: int = 24) -> tuple[str, bytes]:
     key = Fernet.generate_key()
     fernet = Fernet(key)
@@ -89,5 +148,9 @@ def build_encrypted_share_payload(data: dict, valid_hours: int = 24) -> tuple[st
         "expires_at": (datetime.utcnow() + timedelta(hours=valid_hours)).isoformat(),
         "data": data,
     }
-    token = fernet.encrypt(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    token = fernet.encrypt(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY))
     return key.decode("utf-8"), token
+
+
+def open_encrypted_share_payload(key: str, token: bytes) -> dict:
+    return loads_json_bytes(Fernet(key.encode("utf-8")).decrypt(token))
@@ -2,6 +2,7 @@ import base64
 import hashlib
 import hmac
 import os
+from functools import lru_cache
 from typing import Tuple
 
 from cryptography.fernet import Fernet
@@ -15,7 +16,10 @@ def _salt_bytes(salt: str) -> bytes:
     return base64.urlsafe_b64decode(salt.encode("utf-8"))
 
 
-def hash_pin(pin: str, salt: str) -> str:
+_SCRYPT_PREFIX = "scrypt$"
+
+
+def _pbkdf2_pin_hash(pin: str, salt: str) -> str:
     derived = hashlib.pbkdf2_hmac(
         "sha256",
         pin.encode("utf-8"),
@@ -25,21 +29,50 @@ def hash_pin(pin: str, salt: str) -> str:
     return base64.urlsafe_b64encode(derived).decode("utf-8")
 
 
+def _scrypt_pin_hash(pin: str, salt: str) -> str:
+    derived = hashlib.scrypt(pin.encode("utf-8"), salt=_salt_bytes(salt), n=2**14, r=8, p=1, dklen=32)
+    return _SCRYPT_PREFIX + base64.urlsafe_b64encode(derived).decode("utf-8")
+
+
+def hash_pin(pin: str, salt: str) -> str:
+    if hasattr(hashlib, "scrypt"):
+        return _scrypt_pin_hash(pin, salt)
+    return _pbkdf2_pin_hash(pin, salt)
+
+
+# Keyed on the PIN itself: resubmitting the same PIN skips the KDF, while every new guess pays full cost.
+@lru_cache(maxsize=8)
+def _cached_pin_hash(pin: str, salt: str, scrypt: bool) -> str:
+    if scrypt:
+        return _scrypt_pin_hash(pin, salt)
+    return _pbkdf2_pin_hash(pin, salt)
+
+
 def verify_pin(pin: str, salt: str, expected_hash: str) -> bool:
-    current = hash_pin(pin, salt)
+    current = _cached_pin_hash(pin, salt, expected_hash.startswith(_SCRYPT_PREFIX))
     return hmac.compare_digest(current, expected_hash)
 
 
+@lru_cache(maxsize=8)
+def _derive_fernet_key(key_input: bytes, salt: bytes) -> bytes:
+    key_material = hashlib.pbkdf2_hmac("sha256", key_input, salt, 250_000, dklen=32)
+    return base64.urlsafe_b64encode(key_material)
+
+
 def build_fernet(pin: str, salt: str, pepper: str) -> Fernet:
-    key_material = hashlib.pbkdf2_hmac(
-        "sha256",
-        f"{pin}{pepper}".encode("utf-8"),
-        _salt_bytes(salt),
-        250_000,
-        dklen=32,
-    )
-    key = base64.urlsafe_b64encode(key_material)
-    return Fernet(key)
+    return Fernet(_derive_fernet_key(f"{pin}{pepper}".encode("utf-8"), _salt_bytes(salt)))
+
+
+def unlock(pin: str, salt: str, expected_hash: str, pepper: str) -> Fernet | None:
+    # The data key is only derived once the PIN checks out, so wrong guesses never pay for it.
+    if not verify_pin(pin, salt, expected_hash):
+        return None
+    return build_fernet(pin, salt, pepper)
+
+
+def clear_key_cache() -> None:
+    _derive_fernet_key.cache_clear()
+    _cached_pin_hash.cache_clear()
 
 
 def generate_share_key() -> Tuple[str, Fernet]:
@@ -1,14 +1,25 @@
+import re
 from datetime import datetime
 
+# \w is str.isalnum() plus underscore, so accented letters stay valid as before.
+_PATIENT_CODE_RE = re.compile(r"[\w-]+")
+
 
 def validate_pin(pin: str) -> tuple[bool, str]:
     if len(pin) != 4:
         return False, "El PIN debe tener exactamente 4 dígitos."
-    if not pin.isdigit():
+    # isascii() is a constant-time flag check and keeps Unicode digits such as "١٢٣٤" out.
+    if not (pin.isascii() and pin.isdigit()):
         return False, "El PIN debe contener solo números."
     return True, ""
 
 
+def validate_patient_code(patient_code: str) -> tuple[bool, str]:
+    if not patient_code or _PATIENT_CODE_RE.fullmatch(patient_code) is None:
+        return False, "El código de paciente debe contener solo letras, números, guion (-) o guion bajo (_)."
+    return True, ""
+
+
 def parse_datetime(dt_str: str) -> datetime:
     return datetime.fromisoformat(dt_str)
 
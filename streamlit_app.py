@@ -1,38 +1,44 @@
-import json
 import os
 from datetime import datetime
+from functools import partial
+from typing import Callable, NamedTuple
 
 import altair as alt
+import orjson
 import pandas as pd
 import streamlit as st
-from cryptography.fernet import Fernet
 from streamlit.errors import StreamlitSecretNotFoundError
 
-from app.analytics import build_timeline, summarize_glucose
+from app.analytics import build_timeline, downsample_minmax, glucose_recommendation, summarize_glucose_cached
 from app.db import (
     create_user,
+    decrypt_record_columns,
     delete_record,
     get_setting,
     get_user,
     has_duplicate,
     init_db,
-    load_records,
+    load_records_ciphertexts,
+    records_fingerprint,
     save_record,
-    set_setting,
+    set_settings_bulk,
 )
 from app.exporters import (
     build_encrypted_share_payload,
     build_pdf_report,
     dataframe_to_csv_bytes,
     dataframe_to_excel_bytes,
+    dataframe_to_share_records,
+    open_encrypted_share_payload,
 )
-from app.security import build_fernet, generate_salt, hash_pin, verify_pin
-from app.validation import validate_glucose_value, validate_pin
+from app.security import build_fernet, clear_key_cache, generate_salt, hash_pin, unlock
+from app.validation import validate_glucose_value, validate_patient_code, validate_pin
 
 st.set_page_config(page_title="¿Cómo va mi glucosa?", layout="wide")
 init_db()
 
 
+@st.cache_resource(show_spinner=False)
 def get_app_pepper() -> str:
     env_pepper = os.getenv("APP_PEPPER")
     if env_pepper:
@@ -44,52 +50,158 @@ def get_app_pepper() -> str:
         return "change-me-before-production"
 
 
-def to_dataframe(records: list[dict]) -> pd.DataFrame:
-    if not records:
+def to_dataframe(columns: dict[str, list]) -> pd.DataFrame:
+    if not columns["id"]:
         return pd.DataFrame()
-    df = pd.DataFrame(records)
-    df["recorded_at"] = pd.to_datetime(df["recorded_at"])
-    return df.sort_values("recorded_at", ascending=False)
+    df = pd.DataFrame(columns)
+    df["recorded_at"] = pd.to_datetime(df["recorded_at"], format="ISO8601", cache=True)
+    # Rows come back from SQLite already ordered by recorded_at, so a stable sort is nearly free.
+    return df.sort_values("recorded_at", ascending=False, kind="mergesort")
+
+
+def _load_frames(patient_code: str) -> dict[str, pd.DataFrame]:
+    # One query and one decrypt pass for every record type, split in Python afterwards.
+    rows_by_type: dict[str, list] = {"glucose": [], "hba1c": [], "event": []}
+    for row in load_records_ciphertexts(patient_code):
+        rows_by_type.setdefault(row["record_type"], []).append(row)
+    frames = {
+        record_type: to_dataframe(decrypt_record_columns(rows, fernet))
+        for record_type, rows in rows_by_type.items()
+    }
+    non_empty = [df for df in frames.values() if not df.empty]
+    frames["all"] = (
+        pd.concat(non_empty, ignore_index=True).sort_values("recorded_at", ascending=False, kind="mergesort")
+        if non_empty
+        else pd.DataFrame()
+    )
+    frames["timeline"] = build_timeline(frames["glucose"], frames["hba1c"], frames["event"])
+    return frames
+
+
+def session_frames(patient_code: str, version: tuple) -> dict[str, pd.DataFrame]:
+    # Reruns on unchanged records reuse this session's frames as-is: no decrypt and no cache copy.
+    cached = st.session_state.get("frames")
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    frames = _load_frames(patient_code)
+    st.session_state["frames"] = (version, frames)
+    return frames
+
+
+def _settings_cache(owner: str) -> dict[str, str | None]:
+    return st.session_state.setdefault(f"settings:{owner}", {})
+
+
+def cached_setting(key: str, default: str | None, owner: str) -> str | None:
+    cache = _settings_cache(owner)
+    if key not in cache:
+        cache[key] = get_setting(key, owner=owner)
+    value = cache[key]
+    return default if value is None else value
+
+
+def save_settings(pairs: list[tuple[str, str]], owner: str) -> None:
+    # Write-through: only values that differ from what this session last read or wrote hit the DB.
+    cache = _settings_cache(owner)
+    changed = [(key, value) for key, value in pairs if cache.get(key) != value]
+    if changed:
+        set_settings_bulk(changed, owner=owner)
+        cache.update(changed)
 
 
-def setting_json(key: str, default, owner: str):
-    raw = get_setting(key, owner=owner)
+class DoctorTargets(NamedTuple):
+    target_low: int = 70
+    target_high: int = 180
+    hypo: int = 70
+    hyper: int = 250
+
+    @classmethod
+    def from_setting(cls, value: dict) -> "DoctorTargets":
+        return cls(*(int(value.get(field, default)) for field, default in cls._field_defaults.items()))
+
+
+def _parse_setting_json(raw: str | None, default):
     if not raw:
         return default
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
         return default
 
 
-def glucose_recommendation(
-    value_mg_dl: float,
-    target_low: int,
-    target_high: int,
-    hypo_threshold: int,
-    hyper_threshold: int,
-) -> tuple[str, str]:
-    if value_mg_dl < 54:
-        return (
-            "error",
-            "Glucosa muy baja. Toma carbohidrato de acción rápida y busca atención médica si no mejora pronto.",
-        )
-    if value_mg_dl < hypo_threshold:
-        return (
-            "warning",
-            "Glucosa baja. Toma carbohidrato de acción rápida, vuelve a medir en 15 minutos y contacta a tu médico si persiste.",
-        )
-    if target_low <= value_mg_dl <= target_high:
-        return ("success", "Valor en rango objetivo. Continúa con tu plan indicado por tu médico.")
-    if value_mg_dl <= hyper_threshold:
-        return (
-            "info",
-            "Valor elevado. Hidrátate, revisa tus indicaciones de tratamiento y vuelve a medir según recomendación médica.",
-        )
-    return (
-        "error",
-        "Glucosa muy elevada. Contacta a tu médico para orientación y considera atención urgente si tienes síntomas.",
-    )
+def setting_json(key: str, default, owner: str, parse: Callable | None = None):
+    raw = cached_setting(key, None, owner)
+    # Parsed values are reused until the raw string changes through save_settings.
+    parsed = st.session_state.setdefault(f"parsed_settings:{owner}", {})
+    cached = parsed.get(key)
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+
+    value = _parse_setting_json(raw, default)
+    if parse is not None:
+        value = parse(value)
+    parsed[key] = (raw, value)
+    return value
+
+
+# Choosing a record to edit or delete only reruns this editor; saves still trigger a full app rerun.
+@st.fragment
+def history_editor(patient_code: str, glucose_df: pd.DataFrame, all_df: pd.DataFrame) -> None:
+    if all_df.empty:
+        st.info("Sin registros para editar o eliminar.")
+    else:
+        st.markdown("**Editar registro de glucosa**")
+        if not glucose_df.empty:
+            glucose_options = {
+                f"{record_id} | {recorded_at} | {value} mg/dL": int(record_id)
+                for record_id, recorded_at, value in zip(
+                    glucose_df["id"], glucose_df["recorded_at"], glucose_df["value_mg_dl"]
+                )
+            }
+            selected_label = st.selectbox("Selecciona registro", list(glucose_options.keys()))
+            selected_id = glucose_options[selected_label]
+            selected_row = glucose_df.loc[glucose_df["id"] == selected_id].iloc[0]
+
+            with st.form("edit_glucose_form"):
+                edit_value = st.number_input("Glucosa (mg/dL)", min_value=20, max_value=600, value=int(selected_row["value_mg_dl"]))
+                context_options = ["Antes de la comida", "Después de la comida", "Glucosa al azar"]
+                current_context = selected_row.get("context", "Glucosa al azar")
+                edit_context = st.selectbox(
+                    "Tipo de medición",
+                    context_options,
+                    index=context_options.index(current_context) if current_context in context_options else 2,
+                )
+                edit_notes = st.text_area("Notas", value=selected_row.get("notes", ""))
+                edit_submit = st.form_submit_button("Guardar cambios")
+
+            if edit_submit:
+                edit_recorded_at = selected_row["recorded_at"].isoformat()
+                if has_duplicate(patient_code, "glucose", edit_recorded_at, exclude_id=selected_id):
+                    st.error("Ya existe otra medición de glucosa con esa fecha/hora.")
+                else:
+                    payload = {
+                        "value_mg_dl": float(edit_value),
+                        "context": edit_context,
+                        "symptoms": selected_row.get("symptoms", ""),
+                        "meds_taken": selected_row.get("meds_taken", []),
+                        "insulin_units": selected_row.get("insulin_units", None),
+                        "dose": selected_row.get("dose", ""),
+                        "notes": edit_notes,
+                    }
+                    save_record(patient_code, "glucose", edit_recorded_at, payload, fernet, record_id=selected_id)
+                    st.success("Registro actualizado.")
+                    st.rerun()
+
+        st.markdown("**Eliminar registro**")
+        delete_options = {
+            f"{record_id} | {recorded_at} | {record_type}": int(record_id)
+            for record_id, recorded_at, record_type in zip(all_df["id"], all_df["recorded_at"], all_df["record_type"])
+        }
+        delete_label = st.selectbox("Selecciona registro a eliminar", list(delete_options.keys()))
+        if st.button("Eliminar seleccionado", type="secondary"):
+            delete_record(delete_options[delete_label], owner=patient_code)
+            st.success("Registro eliminado.")
+            st.rerun()
 
 
 def ensure_authentication() -> None:
@@ -136,9 +248,9 @@ def ensure_authentication() -> None:
                 st.error("No existe ese código de paciente. Puedes crear una cuenta nueva en la otra pestaña.")
                 st.stop()
 
-            if verify_pin(pin, user["pin_salt"], user["pin_hash"]):
-                pepper = get_app_pepper()
-                st.session_state["fernet"] = build_fernet(pin, user["pin_salt"], pepper)
+            user_fernet = unlock(pin, user["pin_salt"], user["pin_hash"], get_app_pepper())
+            if user_fernet is not None:
+                st.session_state["fernet"] = user_fernet
                 st.session_state["authenticated"] = True
                 st.session_state["patient_code"] = user["patient_code"]
                 st.session_state["patient_name"] = user["patient_name"]
@@ -159,9 +271,9 @@ def ensure_authentication() -> None:
             created = st.form_submit_button("Crear cuenta")
 
         if created:
-            code_valid = patient_code and all(ch.isalnum() or ch in "_-" for ch in patient_code)
+            code_valid, code_message = validate_patient_code(patient_code)
             if not code_valid:
-                st.error("El código de paciente debe contener solo letras, números, guion (-) o guion bajo (_).")
+                st.error(code_message)
                 st.stop()
             if get_user(patient_code):
                 st.error("Ese código ya existe. Usa otro código o entra con tu PIN.")
@@ -180,10 +292,15 @@ def ensure_authentication() -> None:
 
             salt = generate_salt()
             create_user(patient_code, patient_name.strip() or patient_code, salt, hash_pin(pin, salt), consent="true")
-            set_setting("doctor_targets", json.dumps({"target_low": 70, "target_high": 180, "hypo": 70, "hyper": 250}), owner=patient_code)
-            set_setting("reminders", json.dumps({"glucose_time": "08:00", "hba1c_day": 90}), owner=patient_code)
-            set_setting("medications", json.dumps([]), owner=patient_code)
-            set_setting("age", "30", owner=patient_code)
+            set_settings_bulk(
+                [
+                    ("doctor_targets", orjson.dumps(DoctorTargets()._asdict()).decode("utf-8")),
+                    ("reminders", orjson.dumps({"glucose_time": "08:00", "hba1c_day": 90}).decode("utf-8")),
+                    ("medications", orjson.dumps([]).decode("utf-8")),
+                    ("age", "30"),
+                ],
+                owner=patient_code,
+            )
 
             pepper = get_app_pepper()
             st.session_state["fernet"] = build_fernet(pin, salt, pepper)
@@ -204,6 +321,10 @@ if st.sidebar.button("Cambiar de paciente / Crear otro"):
     st.session_state.pop("fernet", None)
     st.session_state.pop("patient_code", None)
     st.session_state.pop("patient_name", None)
+    st.session_state.pop(f"settings:{patient_code}", None)
+    st.session_state.pop(f"parsed_settings:{patient_code}", None)
+    st.session_state.pop("frames", None)
+    clear_key_cache()
     st.rerun()
 
 if st.sidebar.button("Cerrar sesión"):
@@ -211,17 +332,21 @@ if st.sidebar.button("Cerrar sesión"):
     st.session_state.pop("fernet", None)
     st.session_state.pop("patient_code", None)
     st.session_state.pop("patient_name", None)
+    st.session_state.pop(f"settings:{patient_code}", None)
+    st.session_state.pop(f"parsed_settings:{patient_code}", None)
+    st.session_state.pop("frames", None)
+    clear_key_cache()
     st.rerun()
 
 patient_name = st.session_state.get("patient_name") or get_user(patient_code)["patient_name"]
-doctor_targets = setting_json("doctor_targets", {"target_low": 70, "target_high": 180, "hypo": 70, "hyper": 250}, owner=patient_code)
+doctor_targets = setting_json("doctor_targets", {}, owner=patient_code, parse=DoctorTargets.from_setting)
 reminders = setting_json("reminders", {"glucose_time": "08:00", "hba1c_day": 90}, owner=patient_code)
 medications = setting_json("medications", [], owner=patient_code)
 
 st.sidebar.header("Perfil del paciente")
 st.sidebar.caption(f"Código: {patient_code}")
 patient_name = st.sidebar.text_input("Nombre", value=patient_name)
-age = int(get_setting("age", "30", owner=patient_code))
+age = int(cached_setting("age", "30", owner=patient_code))
 age = st.sidebar.number_input("Edad", min_value=0, max_value=120, value=age)
 medications = st.sidebar.multiselect(
     "Medicamentos habituales",
@@ -229,24 +354,28 @@ medications = st.sidebar.multiselect(
     default=medications,
 )
 st.session_state["patient_name"] = patient_name
-set_setting("age", str(age), owner=patient_code)
-set_setting("medications", json.dumps(medications), owner=patient_code)
 
 st.sidebar.header("Rangos definidos por el doctor")
-target_low = st.sidebar.number_input("Objetivo mínimo (mg/dL)", min_value=40, max_value=160, value=int(doctor_targets.get("target_low", 70)))
-target_high = st.sidebar.number_input("Objetivo máximo (mg/dL)", min_value=100, max_value=300, value=int(doctor_targets.get("target_high", 180)))
-hypo_threshold = st.sidebar.number_input("Umbral hipoglucemia", min_value=40, max_value=100, value=int(doctor_targets.get("hypo", 70)))
-hyper_threshold = st.sidebar.number_input("Umbral hiperglucemia", min_value=150, max_value=500, value=int(doctor_targets.get("hyper", 250)))
-set_setting(
-    "doctor_targets",
-    json.dumps(
-        {
-            "target_low": target_low,
-            "target_high": target_high,
-            "hypo": hypo_threshold,
-            "hyper": hyper_threshold,
-        }
-    ),
+target_low = st.sidebar.number_input("Objetivo mínimo (mg/dL)", min_value=40, max_value=160, value=doctor_targets.target_low)
+target_high = st.sidebar.number_input("Objetivo máximo (mg/dL)", min_value=100, max_value=300, value=doctor_targets.target_high)
+hypo_threshold = st.sidebar.number_input("Umbral hipoglucemia", min_value=40, max_value=100, value=doctor_targets.hypo)
+hyper_threshold = st.sidebar.number_input("Umbral hiperglucemia", min_value=150, max_value=500, value=doctor_targets.hyper)
+save_settings(
+    [
+        ("age", str(age)),
+        ("medications", orjson.dumps(medications).decode("utf-8")),
+        (
+            "doctor_targets",
+            orjson.dumps(
+                {
+                    "target_low": target_low,
+                    "target_high": target_high,
+                    "hypo": hypo_threshold,
+                    "hyper": hyper_threshold,
+                }
+            ).decode("utf-8"),
+        ),
+    ],
     owner=patient_code,
 )
 
@@ -327,16 +456,33 @@ with tabs[0]:
             save_record(patient_code, "event", recorded_at, {"title": event_title, "notes": event_notes}, fernet)
             st.success("Evento guardado.")
 
+# Loaded after the Registro tab so records saved during this run are already included.
+records_version = records_fingerprint(patient_code)
+frames = session_frames(patient_code, records_version)
+glucose_df = frames["glucose"]
+hba1c_df = frames["hba1c"]
+events_df = frames["event"]
+all_df = frames["all"]
+
+# Shared by the Resumen metrics and the PDF summary lines.
+summary = (
+    summarize_glucose_cached(
+        records_version,
+        glucose_df,
+        target_low,
+        target_high,
+        hypo_threshold,
+        hyper_threshold,
+    )
+    if not glucose_df.empty
+    else None
+)
+
 with tabs[1]:
     st.subheader("Resumen automático para consulta")
-    glucose_df = to_dataframe(load_records(patient_code, fernet, "glucose"))
-    hba1c_df = to_dataframe(load_records(patient_code, fernet, "hba1c"))
-    events_df = to_dataframe(load_records(patient_code, fernet, "event"))
-
     if glucose_df.empty:
         st.info("Aún no hay datos de glucosa.")
     else:
-        summary = summarize_glucose(glucose_df, target_low, target_high, hypo_threshold, hyper_threshold)
         m1, m2, m3, m4 = st.columns(4)
         m1.metric("Promedio 7 días", f"{summary.avg_7d:.1f} mg/dL" if summary.avg_7d else "N/A")
         m2.metric("Promedio 14 días", f"{summary.avg_14d:.1f} mg/dL" if summary.avg_14d else "N/A")
@@ -348,7 +494,7 @@ with tabs[1]:
         r2.metric("Máximo", f"{summary.maximum:.1f} mg/dL")
         r3.metric("Episodios", f"Hipo: {summary.hypo_count} | Hiper: {summary.hyper_count}")
 
-        chart_df = glucose_df.sort_values("recorded_at").copy()
+        chart_df = downsample_minmax(glucose_df.sort_values("recorded_at", kind="mergesort"), "value_mg_dl")
         base = alt.Chart(chart_df).encode(x=alt.X("recorded_at:T", title="Fecha/hora"))
         line = base.mark_line(point=True).encode(y=alt.Y("value_mg_dl:Q", title="Glucosa (mg/dL)"))
 
@@ -370,101 +516,38 @@ with tabs[1]:
 
 with tabs[2]:
     st.subheader("Historial editable")
-    all_records = load_records(patient_code, fernet)
-    all_df = to_dataframe(all_records)
-    glucose_df = to_dataframe(load_records(patient_code, fernet, "glucose"))
-    hba1c_df = to_dataframe(load_records(patient_code, fernet, "hba1c"))
-    events_df = to_dataframe(load_records(patient_code, fernet, "event"))
-
-    timeline = build_timeline(glucose_df, hba1c_df, events_df)
     st.markdown("**Vista cronológica unificada**")
-    st.dataframe(timeline, use_container_width=True)
-
-    if all_df.empty:
-        st.info("Sin registros para editar o eliminar.")
-    else:
-        st.markdown("**Editar registro de glucosa**")
-        if not glucose_df.empty:
-            glucose_options = {
-                f"{row['id']} | {row['recorded_at']} | {row['value_mg_dl']} mg/dL": int(row["id"])
-                for _, row in glucose_df.iterrows()
-            }
-            selected_label = st.selectbox("Selecciona registro", list(glucose_options.keys()))
-            selected_id = glucose_options[selected_label]
-            selected_row = glucose_df.loc[glucose_df["id"] == selected_id].iloc[0]
-
-            with st.form("edit_glucose_form"):
-                edit_value = st.number_input("Glucosa (mg/dL)", min_value=20, max_value=600, value=int(selected_row["value_mg_dl"]))
-                context_options = ["Antes de la comida", "Después de la comida", "Glucosa al azar"]
-                current_context = selected_row.get("context", "Glucosa al azar")
-                edit_context = st.selectbox(
-                    "Tipo de medición",
-                    context_options,
-                    index=context_options.index(current_context) if current_context in context_options else 2,
-                )
-                edit_notes = st.text_area("Notas", value=selected_row.get("notes", ""))
-                edit_submit = st.form_submit_button("Guardar cambios")
+    st.dataframe(frames["timeline"], use_container_width=True)
 
-            if edit_submit:
-                edit_recorded_at = selected_row["recorded_at"].isoformat()
-                if has_duplicate(patient_code, "glucose", edit_recorded_at, exclude_id=selected_id):
-                    st.error("Ya existe otra medición de glucosa con esa fecha/hora.")
-                else:
-                    payload = {
-                        "value_mg_dl": float(edit_value),
-                        "context": edit_context,
-                        "symptoms": selected_row.get("symptoms", ""),
-                        "meds_taken": selected_row.get("meds_taken", []),
-                        "insulin_units": selected_row.get("insulin_units", None),
-                        "dose": selected_row.get("dose", ""),
-                        "notes": edit_notes,
-                    }
-                    save_record(patient_code, "glucose", edit_recorded_at, payload, fernet, record_id=selected_id)
-                    st.success("Registro actualizado.")
-                    st.rerun()
-
-        st.markdown("**Eliminar registro**")
-        delete_options = {
-            f"{row['id']} | {row['recorded_at']} | {row['record_type']}": int(row["id"])
-            for _, row in all_df.iterrows()
-        }
-        delete_label = st.selectbox("Selecciona registro a eliminar", list(delete_options.keys()))
-        if st.button("Eliminar seleccionado", type="secondary"):
-            delete_record(delete_options[delete_label], owner=patient_code)
-            st.success("Registro eliminado.")
-            st.rerun()
+    history_editor(patient_code, glucose_df, all_df)
 
 with tabs[3]:
     st.subheader("Exportación clínica y compartición segura")
-    glucose_df = to_dataframe(load_records(patient_code, fernet, "glucose"))
-    hba1c_df = to_dataframe(load_records(patient_code, fernet, "hba1c"))
-    events_df = to_dataframe(load_records(patient_code, fernet, "event"))
-
     st.markdown("**Exportar en 1 clic**")
+    # Callables are only serialized when the button is clicked, not on every rerun.
     st.download_button(
         "Descargar glucosa CSV",
-        data=dataframe_to_csv_bytes(glucose_df),
+        data=partial(dataframe_to_csv_bytes, glucose_df),
         file_name="glucosa.csv",
         mime="text/csv",
     )
 
-    excel_bytes = dataframe_to_excel_bytes(
-        {
-            "Glucosa": glucose_df,
-            "HbA1c": hba1c_df,
-            "Eventos": events_df,
-        }
-    )
     st.download_button(
         "Descargar Excel clínico",
-        data=excel_bytes,
+        data=partial(
+            dataframe_to_excel_bytes,
+            {
+                "Glucosa": glucose_df,
+                "HbA1c": hba1c_df,
+                "Eventos": events_df,
+            },
+        ),
         file_name="reporte_clinico.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
 
     summary_lines = []
-    if not glucose_df.empty:
-        summary = summarize_glucose(glucose_df, target_low, target_high, hypo_threshold, hyper_threshold)
+    if summary is not None:
         summary_lines = [
             f"Promedio 7 días: {summary.avg_7d:.1f} mg/dL" if summary.avg_7d else "Promedio 7 días: N/A",
             f"Promedio 14 días: {summary.avg_14d:.1f} mg/dL" if summary.avg_14d else "Promedio 14 días: N/A",
@@ -484,22 +567,12 @@ with tabs[3]:
     st.markdown("**Compartir cifrado con el doctor**")
     valid_hours = st.slider("Validez del paquete (horas)", min_value=1, max_value=168, value=24)
     if st.button("Generar paquete cifrado"):
-        glucose_share_df = glucose_df.copy()
-        hba1c_share_df = hba1c_df.copy()
-        events_share_df = events_df.copy()
-        if not glucose_share_df.empty:
-            glucose_share_df["recorded_at"] = glucose_share_df["recorded_at"].astype(str)
-        if not hba1c_share_df.empty:
-            hba1c_share_df["recorded_at"] = hba1c_share_df["recorded_at"].astype(str)
-        if not events_share_df.empty:
-            events_share_df["recorded_at"] = events_share_df["recorded_at"].astype(str)
-
         payload = {
             "patient_name": patient_name,
             "age": age,
-            "glucose": glucose_share_df.to_dict(orient="records"),
-            "hba1c": hba1c_share_df.to_dict(orient="records"),
-            "events": events_share_df.to_dict(orient="records"),
+            "glucose": dataframe_to_share_records(glucose_df),
+            "hba1c": dataframe_to_share_records(hba1c_df),
+            "events": dataframe_to_share_records(events_df),
         }
         share_key, token = build_encrypted_share_payload(payload, valid_hours=valid_hours)
         st.code(f"Clave para doctor (enviar por canal separado): {share_key}")
@@ -516,9 +589,7 @@ with tabs[3]:
     input_key = st.text_input("Clave del paquete")
     if st.button("Descifrar paquete") and uploaded_file and input_key:
         try:
-            token_data = uploaded_file.read()
-            decrypted = Fernet(input_key.encode("utf-8")).decrypt(token_data)
-            unpacked = json.loads(decrypted.decode("utf-8"))
+            unpacked = open_encrypted_share_payload(input_key, uploaded_file.read())
             expires_at = datetime.fromisoformat(unpacked["expires_at"])
             if datetime.utcnow() > expires_at:
                 st.error("El paquete compartido ha expirado.")
@@ -539,7 +610,15 @@ with tabs[4]:
         submitted = st.form_submit_button("Guardar recordatorios")
 
     if submitted:
-        set_setting("reminders", json.dumps({"glucose_time": glucose_time.strftime("%H:%M"), "hba1c_day": int(hba1c_day)}), owner=patient_code)
+        save_settings(
+            [
+                (
+                    "reminders",
+                    orjson.dumps({"glucose_time": glucose_time.strftime("%H:%M"), "hba1c_day": int(hba1c_day)}).decode("utf-8"),
+                )
+            ],
+            owner=patient_code,
+        )
         st.success("Recordatorios guardados.")
 
     st.info(
@@ -1,6 +1,15 @@
+import numpy as np
 import pandas as pd
 
-from app.analytics import summarize_glucose
+from app import analytics
+from app.analytics import (
+    build_timeline,
+    downsample_minmax,
+    glucose_recommendation,
+    glucose_recommendation_levels,
+    summarize_glucose,
+    summarize_glucose_cached,
+)
 
 
 def test_summarize_glucose_basic_metrics():
@@ -23,3 +32,97 @@ def test_summarize_glucose_basic_metrics():
     assert summary.hypo_count == 1
     assert summary.hyper_count == 1
     assert summary.in_range_pct > 0
+
+
+def test_summarize_glucose_window_averages():
+    now = pd.Timestamp.now()
+    df = pd.DataFrame(
+        {
+            "recorded_at": [now - pd.Timedelta(days=days) for days in (1, 3, 10, 20, 45)],
+            "value_mg_dl": [100.0, 120.0, 140.0, 160.0, 300.0],
+        }
+    )
+
+    summary = summarize_glucose(df, target_low=70, target_high=180, hypo_threshold=70, hyper_threshold=250)
+
+    assert summary.avg_7d == 110.0
+    assert summary.avg_14d == 120.0
+    assert summary.avg_30d == 130.0
+    assert summary.in_range_pct == 80.0
+    assert type(summary.in_range_pct) is float
+    assert summary.hyper_count == 1
+
+
+def test_build_timeline_merges_sources_without_mutating_inputs():
+    glucose_df = pd.DataFrame(
+        {
+            "recorded_at": pd.to_datetime(["2024-01-03T08:00:00", "2024-01-01T08:00:00"]),
+            "value_mg_dl": [110.0, 95.0],
+            "context": ["Antes de la comida", "Glucosa al azar"],
+            "notes": ["", "ayuno"],
+        }
+    )
+    hba1c_df = pd.DataFrame({"recorded_at": pd.to_datetime(["2024-01-02T09:00:00"]), "value_pct": [6.5], "notes": [""]})
+    events_df = pd.DataFrame({"recorded_at": pd.to_datetime(["2024-01-04T10:00:00"]), "title": ["Caminata"], "notes": ["30 min"]})
+
+    timeline = build_timeline(glucose_df, hba1c_df, events_df)
+
+    assert list(timeline["evento"]) == ["Caminata", "Glucosa", "HbA1c", "Glucosa"]
+    assert timeline.iloc[1]["detalle"] == "110.0 mg/dL | Antes de la comida"
+    assert "evento" not in glucose_df.columns
+
+
+def test_summarize_glucose_cached_computes_only_on_miss(monkeypatch):
+    df = pd.DataFrame({"recorded_at": [pd.Timestamp.now()], "value_mg_dl": [120.0]})
+    calls = []
+
+    def counting_summary(*args):
+        calls.append(1)
+        return summarize_glucose(*args)
+
+    monkeypatch.setattr(analytics, "summarize_glucose", counting_summary)
+    first = summarize_glucose_cached(("p1", "glucose", "t1", 1), df, 70, 180, 70, 250)
+    second = summarize_glucose_cached(("p1", "glucose", "t1", 1), df, 70, 180, 70, 250)
+    summarize_glucose_cached(("p1", "glucose", "t2", 2), df, 70, 180, 70, 250)
+
+    assert first == second == summarize_glucose(df, 70, 180, 70, 250)
+    assert len(calls) == 2
+
+
+def test_glucose_recommendation_follows_rule_order():
+    thresholds = dict(target_low=70, target_high=180, hypo_threshold=70, hyper_threshold=250)
+
+    assert glucose_recommendation(50, **thresholds)[0] == "error"
+    assert glucose_recommendation(60, **thresholds)[0] == "warning"
+    assert glucose_recommendation(180, **thresholds)[0] == "success"
+    assert glucose_recommendation(250, **thresholds)[0] == "info"
+    assert glucose_recommendation(251, **thresholds)[0] == "error"
+
+
+def test_glucose_recommendation_levels_handle_unordered_thresholds():
+    values = np.array([40.0, 50.0, 65.0, 75.0, 190.0, 300.0, np.nan])
+
+    levels = glucose_recommendation_levels(values, target_low=80, target_high=200, hypo_threshold=45, hyper_threshold=150)
+
+    # 75 sits below the target but above hypo, 190 is in target even though it exceeds hyper.
+    assert levels.tolist() == [0, 0, 3, 3, 2, 4, 4]
+
+
+def test_downsample_minmax_keeps_small_frames_untouched():
+    df = pd.DataFrame({"value_mg_dl": [100.0, 120.0, 90.0]})
+
+    assert downsample_minmax(df, "value_mg_dl", max_points=10) is df
+
+
+def test_downsample_minmax_caps_points_and_keeps_extremes():
+    values = np.full(10_001, 120.0)
+    values[1234] = 45.0
+    values[7777] = 480.0
+    values[500] = np.nan
+    df = pd.DataFrame({"recorded_at": pd.date_range("2024-01-01", periods=len(values), freq="5min"), "value_mg_dl": values})
+
+    sampled = downsample_minmax(df, "value_mg_dl", max_points=2000)
+
+    assert len(sampled) <= 2000
+    assert sampled["recorded_at"].is_monotonic_increasing
+    assert {0, 1234, 7777, 10_000} <= set(sampled.index)
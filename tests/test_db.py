@@ -0,0 +1,183 @@
+import json
+import math
+import sqlite3
+
+import pytest
+from cryptography.fernet import Fernet
+
+from app import db
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "app.db")
+    db.init_db()
+    return db
+
+
+def test_settings_roundtrip(fresh_db):
+    fresh_db.set_setting("age", "41", owner="p1")
+
+    assert fresh_db.get_setting("age", owner="p1") == "41"
+    assert fresh_db.get_setting("age", "30", owner="p2") == "30"
+
+
+def test_connection_is_reused_with_wal(fresh_db):
+    conn = fresh_db.get_connection()
+
+    assert fresh_db.get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_transaction_rolls_back_on_error(fresh_db):
+    with pytest.raises(RuntimeError):
+        with fresh_db.transaction() as conn:
+            conn.execute("INSERT INTO settings(key, value) VALUES ('k', 'v')")
+            raise RuntimeError("boom")
+
+    assert fresh_db.get_setting("k") is None
+
+
+def test_transaction_rolls_back_when_commit_fails(tmp_path):
+    db_path = tmp_path / "deferred.db"
+    conn = db.get_connection(db_path)
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("CREATE TABLE parent (id INTEGER PRIMARY KEY)")
+    conn.execute(
+        "CREATE TABLE child (parent_id INTEGER REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED)"
+    )
+
+    # A deferred foreign key is only checked at COMMIT, so the commit itself raises.
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction(db_path) as tx:
+            tx.execute("INSERT INTO child(parent_id) VALUES (1)")
+
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM child").fetchone()[0] == 0
+
+
+def test_save_load_and_delete_records(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    record_id = fresh_db.save_record("p1", "glucose", "2024-01-01T08:00:00", {"value_mg_dl": 110.0}, fernet)
+    fresh_db.save_record("p2", "glucose", "2024-01-01T08:00:00", {"value_mg_dl": 95.0}, fernet)
+
+    rows = fresh_db.load_records("p1", fernet, "glucose")
+    assert [row["value_mg_dl"] for row in rows] == [110.0]
+    assert fresh_db.has_duplicate("p1", "glucose", "2024-01-01T08:00:00")
+    assert not fresh_db.has_duplicate("p1", "glucose", "2024-01-01T08:00:00", exclude_id=record_id)
+
+    fresh_db.delete_record(record_id, owner="p1")
+    assert fresh_db.load_records("p1", fernet) == []
+
+
+def test_save_records_bulk_is_all_or_nothing(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    rows = [(f"2024-01-0{day}T08:00:00", {"value_mg_dl": 100.0 + day}) for day in range(1, 4)]
+
+    assert fresh_db.save_records_bulk("p1", "glucose", rows, fernet) == 3
+    assert [row["value_mg_dl"] for row in fresh_db.load_records("p1", fernet)] == [103.0, 102.0, 101.0]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        fresh_db.save_records_bulk("p1", "glucose", [("2024-02-01T08:00:00", {}), rows[0]], fernet)
+    assert len(fresh_db.load_records("p1", fernet)) == 3
+
+
+def test_record_listings_do_not_sort_in_temp_btree(fresh_db):
+    conn = fresh_db.get_connection()
+    for params, extra in ((("p1",), ""), (("p1", "glucose"), " AND record_type = ?")):
+        plan = conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT id FROM records WHERE owner = ?{extra} ORDER BY recorded_at DESC",
+            params,
+        ).fetchall()
+        assert not any("TEMP B-TREE" in row["detail"] for row in plan)
+
+
+def test_records_fingerprint_tracks_changes(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    empty = fresh_db.records_fingerprint("p1", "glucose")
+    record_id = fresh_db.save_record("p1", "glucose", "2024-01-01T08:00:00", {"value_mg_dl": 110.0}, fernet)
+    saved = fresh_db.records_fingerprint("p1", "glucose")
+    fresh_db.save_record("p1", "hba1c", "2024-01-01T08:00:00", {"value_pct": 6.1}, fernet)
+
+    assert empty == ("p1", "glucose", None, 0)
+    assert saved[3] == 1
+    assert fresh_db.records_fingerprint("p1", "glucose") == saved
+
+    fresh_db.delete_record(record_id, owner="p1")
+    assert fresh_db.records_fingerprint("p1", "glucose") == empty
+
+
+def test_load_record_columns_aligns_mixed_payloads(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    fresh_db.save_record("p1", "hba1c", "2024-01-01T08:00:00", {"value_pct": 6.1, "notes": ""}, fernet)
+    fresh_db.save_record("p1", "event", "2024-01-02T08:00:00", {"title": "Caminata", "notes": "30 min"}, fernet)
+
+    columns = fresh_db.load_record_columns("p1", fernet)
+
+    assert columns["record_type"] == ["event", "hba1c"]
+    assert columns["title"] == ["Caminata", None]
+    assert columns["value_pct"] == [None, 6.1]
+    assert columns["notes"] == ["30 min", ""]
+    assert fresh_db.load_record_columns("p2", fernet)["id"] == []
+
+
+def test_loads_json_bytes_accepts_stdlib_nan():
+    assert db.loads_json_bytes(b'{"value_mg_dl": 98.0}') == {"value_mg_dl": 98.0}
+
+    legacy = db.loads_json_bytes(json.dumps({"insulin_units": float("nan")}).encode("utf-8"))
+    assert math.isnan(legacy["insulin_units"])
+
+
+def test_load_records_reads_legacy_json_payloads(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    legacy = fernet.encrypt(b'{"value_mg_dl": 98.0, "insulin_units": NaN, "notes": "ma\\u00f1ana"}').decode("utf-8")
+    with fresh_db.transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO records(owner, record_type, recorded_at, payload_encrypted, created_at, updated_at)
+            VALUES ('p1', 'glucose', '2024-01-01T08:00:00', ?, '', '')
+            """,
+            (legacy,),
+        )
+
+    (row,) = fresh_db.load_records("p1", fernet, "glucose")
+    assert row["value_mg_dl"] == 98.0
+    assert row["notes"] == "mañana"
+
+
+def test_payloads_are_stored_as_blobs(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    fresh_db.save_record("p1", "glucose", "2024-01-01T08:00:00", {"value_mg_dl": 110.0}, fernet)
+
+    stored_type = fresh_db.get_connection().execute("SELECT typeof(payload_encrypted) FROM records").fetchone()[0]
+    assert stored_type == "blob"
+
+
+def test_set_settings_bulk_upserts_scoped_keys(fresh_db):
+    fresh_db.set_setting("age", "30", owner="p1")
+    fresh_db.set_settings_bulk([("age", "52"), ("medications", "[]")], owner="p1")
+
+    assert fresh_db.get_setting("age", owner="p1") == "52"
+    assert fresh_db.get_setting("medications", owner="p1") == "[]"
+    assert fresh_db.get_setting("age") is None
+
+
+def test_load_records_since_skips_older_rows(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    rows = [(f"2024-01-0{day}T08:00:00", {"value_mg_dl": 100.0 + day}) for day in range(1, 5)]
+    fresh_db.save_records_bulk("p1", "glucose", rows, fernet)
+
+    recent = fresh_db.load_records("p1", fernet, "glucose", since="2024-01-03T00:00:00")
+    assert [row["recorded_at"] for row in recent] == ["2024-01-04T08:00:00", "2024-01-03T08:00:00"]
+    assert fresh_db.load_record_columns("p1", fernet, since="2024-01-04T08:00:00")["value_mg_dl"] == [104.0]
+
+
+def test_ciphertexts_decrypt_to_the_same_columns(fresh_db):
+    fernet = Fernet(Fernet.generate_key())
+    fresh_db.save_record("p1", "glucose", "2024-01-01T08:00:00", {"value_mg_dl": 110.0}, fernet)
+    fresh_db.save_record("p1", "event", "2024-01-02T08:00:00", {"title": "Caminata"}, fernet)
+
+    rows = fresh_db.load_records_ciphertexts("p1")
+
+    assert [row["record_type"] for row in rows] == ["event", "glucose"]
+    assert fresh_db.decrypt_record_columns(rows, fernet) == fresh_db.load_record_columns("p1", fernet)
@@ -0,0 +1,129 @@
+import io
+import zipfile
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+
+from app.exporters import (
+    build_encrypted_share_payload,
+    build_pdf_report,
+    dataframe_to_csv_bytes,
+    dataframe_to_excel_bytes,
+    dataframe_to_share_records,
+    open_encrypted_share_payload,
+)
+
+
+def _glucose_df(rows: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "recorded_at": pd.date_range("2024-01-01", periods=rows, freq="h"),
+            "value_mg_dl": [100.0 + i for i in range(rows)],
+            "context": ["Glucosa al azar"] * rows,
+            "notes": [""] * rows,
+        }
+    )
+
+
+def test_build_pdf_report_handles_empty_frames():
+    pdf = build_pdf_report("Paciente", [], pd.DataFrame(), pd.DataFrame())
+
+    assert pdf.startswith(b"%PDF")
+
+
+def test_build_pdf_report_breaks_long_sections_across_pages():
+    hba1c_df = pd.DataFrame({"recorded_at": pd.date_range("2024-01-01", periods=3, freq="D"), "value_pct": [6.1, 6.3, 6.0]})
+    summary_lines = [f"Linea {i}" for i in range(60)]
+
+    pdf = build_pdf_report("Paciente", summary_lines, _glucose_df(20), hba1c_df)
+
+    assert pdf.count(b"/Type /Page\n") >= 2
+
+
+_XLSX_NS = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+def _xlsx_cells(data: bytes) -> dict[str, dict[str, object]]:
+    # Reads the workbook straight from the zip so the check does not depend on an Excel reader.
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        names = [sheet.get("name") for sheet in workbook.iterfind(".//x:sheet", _XLSX_NS)]
+        sheets = {}
+        for index, name in enumerate(names, 1):
+            root = ElementTree.fromstring(archive.read(f"xl/worksheets/sheet{index}.xml"))
+            cells = {}
+            for cell in root.iterfind(".//x:c", _XLSX_NS):
+                if cell.get("t") == "inlineStr":
+                    cells[cell.get("r")] = cell.findtext("x:is/x:t", namespaces=_XLSX_NS)
+                else:
+                    cells[cell.get("r")] = float(cell.findtext("x:v", namespaces=_XLSX_NS))
+            sheets[name] = cells
+    return sheets
+
+
+def test_dataframe_to_excel_bytes_keeps_every_cell():
+    glucose_df = _glucose_df(3).assign(meds_taken=[["Insulina"], [], ["Metformina", "Otros"]])
+
+    sheets = _xlsx_cells(dataframe_to_excel_bytes({"Glucosa": glucose_df, "HbA1c": pd.DataFrame()}))
+
+    assert list(sheets) == ["Glucosa", "HbA1c"]
+    glucose = sheets["Glucosa"]
+    assert [glucose[f"{column}1"] for column in "ABCE"] == ["recorded_at", "value_mg_dl", "context", "meds_taken"]
+    assert [glucose[f"B{row}"] for row in (2, 3, 4)] == [100.0, 101.0, 102.0]
+    assert [glucose[f"C{row}"] for row in (2, 3, 4)] == ["Glucosa al azar"] * 3
+    # Excel serial dates: 2024-01-01 is day 45292, rows are one hour apart.
+    assert [round(glucose[f"A{row}"] * 24) for row in (2, 3, 4)] == [45292 * 24, 45292 * 24 + 1, 45292 * 24 + 2]
+    assert [glucose[f"E{row}"] for row in (2, 3, 4)] == ["['Insulina']", "[]", "['Metformina', 'Otros']"]
+    assert sheets["HbA1c"] == {}
+
+
+def test_dataframe_to_excel_bytes_leaves_missing_values_blank():
+    glucose_df = _glucose_df(3).assign(value_mg_dl=[100.0, float("nan"), 102.0], notes=["=1+1", None, "cena"])
+
+    glucose = _xlsx_cells(dataframe_to_excel_bytes({"Glucosa": glucose_df}))["Glucosa"]
+
+    assert "B3" not in glucose
+    assert "D3" not in glucose
+    assert glucose["D2"] == "=1+1"
+    assert glucose["D4"] == "cena"
+
+
+def test_dataframe_to_csv_bytes_matches_pandas_text_output():
+    glucose_df = _glucose_df(3).assign(notes=["mañana", "", "cena, tarde"])
+
+    assert dataframe_to_csv_bytes(glucose_df) == glucose_df.to_csv(index=False).encode("utf-8")
+    assert dataframe_to_csv_bytes(pd.DataFrame()) == pd.DataFrame().to_csv(index=False).encode("utf-8")
+
+
+def test_dataframe_to_share_records_formats_timestamps_without_touching_the_frame():
+    glucose_df = _glucose_df(2).assign(id=[1, 2], owner="p1", record_type="glucose")
+
+    records = dataframe_to_share_records(glucose_df)
+
+    assert records[0] == {
+        "recorded_at": "2024-01-01T00:00:00",
+        "value_mg_dl": 100.0,
+        "context": "Glucosa al azar",
+        "notes": "",
+        "id": 1,
+    }
+    assert "owner" in glucose_df
+    assert pd.api.types.is_datetime64_any_dtype(glucose_df["recorded_at"])
+    assert dataframe_to_share_records(pd.DataFrame()) == []
+
+
+def test_share_payload_roundtrip():
+    key, token = build_encrypted_share_payload({"patient_name": "Ana", "glucose": [{"value_mg_dl": 110.0}]}, valid_hours=2)
+
+    unpacked = open_encrypted_share_payload(key, token)
+
+    assert unpacked["data"]["patient_name"] == "Ana"
+    assert unpacked["data"]["glucose"] == [{"value_mg_dl": 110.0}]
+    assert "expires_at" in unpacked
+
+
+def test_share_payload_serializes_numpy_values_and_missing_numbers():
+    key, token = build_encrypted_share_payload({"glucose": [{"id": np.int64(3), "value_mg_dl": np.float64(110.5), "insulin_units": float("nan")}]})
+
+    assert open_encrypted_share_payload(key, token)["data"]["glucose"] == [{"id": 3, "value_mg_dl": 110.5, "insulin_units": None}]
@@ -0,0 +1,79 @@
+from app.security import (
+    _cached_pin_hash,
+    _derive_fernet_key,
+    _pbkdf2_pin_hash,
+    build_fernet,
+    clear_key_cache,
+    generate_salt,
+    hash_pin,
+    unlock,
+    verify_pin,
+)
+
+
+def test_hash_pin_roundtrip():
+    salt = generate_salt()
+    pin_hash = hash_pin("1234", salt)
+
+    assert pin_hash.startswith("scrypt$")
+    assert verify_pin("1234", salt, pin_hash)
+    assert not verify_pin("4321", salt, pin_hash)
+
+
+def test_verify_pin_accepts_legacy_pbkdf2_hashes():
+    salt = generate_salt()
+    legacy_hash = _pbkdf2_pin_hash("1234", salt)
+
+    assert verify_pin("1234", salt, legacy_hash)
+    assert not verify_pin("0000", salt, legacy_hash)
+
+
+def test_build_fernet_is_deterministic():
+    salt = generate_salt()
+    token = build_fernet("1234", salt, "pepper").encrypt(b"dato")
+
+    assert build_fernet("1234", salt, "pepper").decrypt(token) == b"dato"
+
+
+def test_build_fernet_reuses_derived_key_until_cleared():
+    clear_key_cache()
+    salt = generate_salt()
+    build_fernet("1234", salt, "pepper")
+    build_fernet("1234", salt, "pepper")
+
+    assert _derive_fernet_key.cache_info().hits == 1
+
+    clear_key_cache()
+    assert _derive_fernet_key.cache_info().currsize == 0
+
+
+def test_unlock_returns_fernet_only_for_the_right_pin():
+    salt = generate_salt()
+    pin_hash = hash_pin("1234", salt)
+    token = build_fernet("1234", salt, "pepper").encrypt(b"dato")
+
+    assert unlock("1234", salt, pin_hash, "pepper").decrypt(token) == b"dato"
+    assert unlock("4321", salt, pin_hash, "pepper") is None
+
+
+def test_unlock_does_not_derive_keys_for_wrong_pins():
+    clear_key_cache()
+    salt = generate_salt()
+    pin_hash = hash_pin("1234", salt)
+
+    assert unlock("4321", salt, pin_hash, "pepper") is None
+    assert _derive_fernet_key.cache_info().currsize == 0
+
+
+def test_verify_pin_reuses_hash_only_for_the_same_pin():
+    clear_key_cache()
+    salt = generate_salt()
+    pin_hash = hash_pin("1234", salt)
+
+    assert not verify_pin("4321", salt, pin_hash)
+    assert verify_pin("1234", salt, pin_hash)
+    assert verify_pin("1234", salt, pin_hash)
+    assert _cached_pin_hash.cache_info().hits == 1
+
+    clear_key_cache()
+    assert _cached_pin_hash.cache_info().currsize == 0
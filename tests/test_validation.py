@@ -1,4 +1,4 @@
-from app.validation import validate_glucose_value, validate_pin
+from app.validation import validate_glucose_value, validate_patient_code, validate_pin
 
 
 def test_validate_pin_rules():
@@ -11,6 +11,22 @@ def test_validate_pin_rules():
     ok_alpha, _ = validate_pin("12ab")
     assert not ok_alpha
 
+    ok_unicode_digits, _ = validate_pin("١٢٣٤")
+    assert not ok_unicode_digits
+
+    ok_superscript, _ = validate_pin("12²3")
+    assert not ok_superscript
+
+
+def test_validate_patient_code_rules():
+    for code in ("ana-01", "Paciente_7", "José"):
+        ok, _ = validate_patient_code(code)
+        assert ok
+
+    for code in ("", "ana 01", "ana.01", "ana01\n"):
+        ok, _ = validate_patient_code(code)
+        assert not ok
+
 
 def test_validate_glucose_value_rules():
     valid, _ = validate_glucose_value(110)